@@ -1,12 +1,12 @@
 import streamlit as st
 import pandas as pd
-import re
+from datetime import date
 
 # 引入我們拆分出去的模組 (含新增的 logic_advanced)
-from utils import load_google_sheet 
+from utils import load_google_sheet, get_sheet_catalog, earliest_data_date, date_range_selector, slice_by_date, clip_range, get_trade_table, measure_session_memory, snapshot_key, cached_figure, get_figure_cache
 from logic_yearly import get_yearly_data_and_chart 
-from logic_expectancy import display_expectancy_lab 
-from logic_advanced import display_advanced_analysis # <--- [NEW] 新增這行
+from logic_expectancy import display_expectancy_lab, get_expectancy_data
+from logic_advanced import display_advanced_analysis, get_advanced_data # <--- [NEW] 新增這行
 
 # --- 1. 頁面設定 ---
 st.set_page_config(page_title="私募基金戰情室", layout="wide")
@@ -24,7 +24,27 @@ if err_msg:
     st.error(err_msg)
     st.stop()
 
-# --- 4. 分頁架構 (新增第 4 個分頁) ---
+# --- 4. 全域日期區間 (四個分頁共用) ---
+# 自動偵測年份 (由分頁索引提供)
+detected_years = get_sheet_catalog(xls).years()
+target_years = detected_years if detected_years else [2025, 2024, 2023, 2022, 2021]
+# 預設起日取期望值交易與日報表中最早的一天，避免預設就把較早的交易排除
+first_date = earliest_data_date(xls) or date(min(target_years), 1, 1)
+date_range = date_range_selector(first_date)
+
+# 共用唯讀交易表的記憶體量測 (N 個同時在線 session)
+with st.sidebar.expander("🧠 記憶體用量"):
+    trade_table, _ = get_trade_table(xls)
+    if trade_table is not None:
+        n_sessions = st.number_input("同時在線人數", min_value=1, value=10, step=1)
+        filtered = (get_expectancy_data(xls)[0], get_advanced_data(xls)[0])
+        mem = measure_session_memory(snapshot_key(xls), trade_table, filtered, int(n_sessions))
+        st.caption(f"共用唯讀表 {mem['Shared Table']/1024:,.1f} KB ＋ 篩選複本 {mem['Filtered Copies']/1024:,.1f} KB ＋ 檢視 (估) {mem['View Overhead']/1024:,.1f} KB")
+        st.metric("共用後總量", f"{mem['Shared Total']/1024:,.1f} KB", delta=f"{(mem['Shared Total']-mem['Legacy Total'])/1024:,.1f} KB vs 各自複製 (估)", delta_color="inverse")
+    fig_stats = get_figure_cache().stats()
+    st.caption(f"圖表快取 {fig_stats['Entries']} 張 / {fig_stats['Bytes']/1024:,.0f} KB，命中率 {fig_stats['Hit Rate']*100:.1f}% ({fig_stats['Hits']}/{fig_stats['Hits']+fig_stats['Misses']})")
+
+# --- 5. 分頁架構 (新增第 4 個分頁) ---
 tab1, tab2, tab3, tab4 = st.tabs(["📊 總覽儀表板", "📅 年度戰績回顧", "🧪 期望值實驗室", "🔍 進階細項分析"])
 
 # === Tab 1: 總覽 ===
@@ -39,29 +59,27 @@ with tab1:
                     h_idx = i; break
             if h_idx != -1:
                 df_total = pd.read_excel(xls, '累積總表', header=h_idx)
+                d_col = next((c for c in df_total.columns if '日期' in str(c)), None)
+                if d_col:
+                    df_total[d_col] = pd.to_datetime(df_total[d_col], errors='coerce')
+                    df_total = slice_by_date(df_total.dropna(subset=[d_col]), date_range, col=d_col)
                 y_col = next((c for c in df_total.columns if '累積損益' in str(c)), None)
-                if y_col:
+                if y_col and not df_total.empty:
                     latest_val = df_total[y_col].iloc[-1]
                     st.metric("歷史總權益", f"${latest_val:,.0f}")
                     import plotly.express as px
-                    st.plotly_chart(px.line(df_total, y=y_col, title="歷史資金成長"), use_container_width=True)
+                    st.plotly_chart(px.line(df_total, x=d_col, y=y_col, title="歷史資金成長"), use_container_width=True)
         except: pass
 
 # === Tab 2: 年度回顧 (由 logic_yearly.py 接管) ===
 with tab2:
-    # 自動偵測年份
-    detected_years = set()
-    for name in xls.sheet_names:
-        clean_name = re.sub(r"[ _－/.-]", "", str(name))
-        match = re.search(r"日報表(\d{4})", clean_name)
-        if match: detected_years.add(int(match.group(1)))
-    target_years = sorted(list(detected_years), reverse=True) if detected_years else [2025, 2024, 2023, 2022, 2021]
-
     progress_bar = st.progress(0, text="數據載入中...")
     
     for i, year in enumerate(target_years):
         # 呼叫 logic_yearly
-        result = get_yearly_data_and_chart(xls, year)
+        # 以該年度裁切後的區間為鍵：調整全域區間時，裁切結果未變的年度直接沿用
+        year_range = clip_range(date_range, f"{year}-01-01", f"{year}-12-31")
+        result = cached_figure(snapshot_key(xls, year_range), (year,), get_yearly_data_and_chart, xls, year, year_range) if year_range else None
         
         if result:
             fig, final, high, low, mdd, m_stats = result
@@ -84,8 +102,8 @@ with tab2:
 
 # === Tab 3: 期望值實驗室 (由 logic_expectancy.py 接管) ===
 with tab3:
-    display_expectancy_lab(xls)
+    display_expectancy_lab(xls, date_range)
 
 # === Tab 4: 進階細項分析 (由 logic_advanced.py 接管) ===
 with tab4:
-    display_advanced_analysis(xls)
+    display_advanced_analysis(xls, date_range)
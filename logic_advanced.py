@@ -3,53 +3,149 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
+from logic_portfolio import optimize_strategy_subsets
+from utils import slice_by_date, get_trade_table, table_view, WORKBOOK_HASH, WEEKDAYS, snapshot_key, cached_figure
 
 # ==========================================
-# 0. 資料處理核心 (修復為名稱對應)
+# 0. 資料處理核心 (共用唯讀交易表)
 # ==========================================
 
+@st.cache_resource(ttl=60, max_entries=2, hash_funcs=WORKBOOK_HASH, show_spinner=False)
 def get_advanced_data(xls):
-    """從 Excel 讀取數據，並對齊最新欄位名稱"""
-    target_sheet = next((name for name in xls.sheet_names if "期望值" in name), None)
-    if not target_sheet: return None, "找不到 '期望值' 分頁"
-    
-    try:
-        # header=14 代表從第 15 列開始抓取
-        df = pd.read_excel(xls, sheet_name=target_sheet, header=14)
-        
-        # 欄位映射表：完全對齊您 Excel 的最新中文字標題
-        mapping = {
-            '日期': 'Date',
-            '策略': 'Strategy',
-            '標的': 'Symbol',
-            '1R單位': 'Risk_Amount',
-            '損益': 'PnL',
-            '標準R(盈虧比)': 'R' 
-        }
-        
-        # 檢查與預設值處理
-        for excel_col, target_col in mapping.items():
-            if excel_col not in df.columns:
-                if target_col == 'Strategy': df[excel_col] = '未分類'
-                elif target_col == 'Symbol': df[excel_col] = '未知標的'
-                else: df[excel_col] = np.nan
-        
-        df_clean = df[[col for col in mapping.keys() if col in df.columns]].copy()
-        df_clean.rename(columns=mapping, inplace=True)
-
-        # 數值轉型
-        df_clean['Date'] = pd.to_datetime(df_clean['Date'], errors='coerce')
-        for col in ['PnL', 'R', 'Risk_Amount']:
-            if col in df_clean.columns:
-                df_clean[col] = pd.to_numeric(df_clean[col].astype(str).str.replace(',', ''), errors='coerce')
-        
-        df_clean = df_clean.dropna(subset=['Date', 'PnL'])
-        df_clean = df_clean[df_clean['PnL'] != 0]
-        df_clean['Weekday'] = df_clean['Date'].dt.day_name()
-        
-        return df_clean.sort_values('Date'), None
-    except Exception as e:
-        return None, f"讀取失敗: {e}"
+    """從共用唯讀交易表取出有損益的交易 (每份快照全程序只篩選一次)"""
+    table, err = get_trade_table(xls)
+    if err: return None, err
+    return table_view(table, table['PnL'] != 0), None
+
+def build_daily_pnl_matrix(df):
+    """將交易一次樞紐為 日期 × 策略 的每日損益矩陣 (無交易日補 0)"""
+    day_codes, days = pd.factorize(df['Date'], sort=True)
+    strat_codes, strategies = pd.factorize(df['Strategy'].astype(str), sort=True)
+    n_days, n_strats = len(days), len(strategies)
+    flat = np.bincount(day_codes * n_strats + strat_codes, weights=df['PnL'].to_numpy(dtype='float64'), minlength=n_days * n_strats)
+    return pd.DataFrame(flat.reshape(n_days, n_strats), index=pd.DatetimeIndex(days, name='Date'), columns=pd.Index(strategies, name='Strategy'))
+
+def max_drawdown(pnl):
+    """每欄各自的最大回檔 (負值)；pnl 為 日期 × N 的每日損益矩陣"""
+    cum = np.cumsum(pnl, axis=0)
+    return (cum - np.maximum.accumulate(cum, axis=0)).min(axis=0)
+
+def rolling_sum(x, window):
+    """沿第 0 軸的滾動加總 (前 window-1 列為 NaN)"""
+    c = np.cumsum(x, axis=0)
+    out = np.full(x.shape, np.nan)
+    out[window - 1:] = c[window - 1:]
+    out[window:] -= c[:-window]
+    return out
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def get_strategy_correlation(snapshot, _df, window=20):
+    """
+    策略相關性與組合貢獻 (以 snapshot 為快取鍵)：
+    回傳 相關係數矩陣、各策略與其餘組合的滾動相關、各策略對總損益/波動/MDD 的邊際貢獻。
+    """
+    mat = build_daily_pnl_matrix(_df)
+    X = mat.to_numpy()
+    n, k = X.shape
+    port = X.sum(axis=1)
+
+    # 全期相關係數：中心化後一次矩陣乘法
+    centered = X - X.mean(axis=0)
+    cov = centered.T @ centered / max(n - 1, 1)
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.outer(std, std)
+    corr_df = pd.DataFrame(corr, index=mat.columns, columns=mat.columns)
+
+    # 滾動相關：各策略 vs. 其餘策略合計，以滾動加總一次算完所有欄
+    rest = port[:, None] - X
+    w = min(window, n)
+    sx, sy = rolling_sum(X, w), rolling_sum(rest, w)
+    sxx, syy, sxy = rolling_sum(X * X, w), rolling_sum(rest * rest, w), rolling_sum(X * rest, w)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rolling = (w * sxy - sx * sy) / np.sqrt((w * sxx - sx ** 2) * (w * syy - sy ** 2))
+    rolling_df = pd.DataFrame(rolling, index=mat.index, columns=mat.columns)
+
+    # 邊際貢獻：波動採 Euler 分解 (Σ·1 / σp，加總即組合波動)，MDD 採逐一剔除比較
+    port_vol = np.sqrt(cov.sum())
+    vol_contrib = cov.sum(axis=1) / port_vol if port_vol > 0 else np.zeros(k)
+    port_mdd = max_drawdown(port[:, None])[0]
+    mdd_without = max_drawdown(rest)
+    total = X.sum(axis=0)
+
+    contrib_df = pd.DataFrame({
+        'Strategy': mat.columns,
+        'Total_PnL': total,
+        'PnL_Share': total / port.sum() if port.sum() != 0 else np.nan,
+        'Vol_Contrib': vol_contrib,
+        'Vol_Share': vol_contrib / port_vol if port_vol > 0 else np.nan,
+        'MDD_Without': mdd_without,
+        'MDD_Contrib': port_mdd - mdd_without,
+        'Avg_Corr': (np.nansum(corr, axis=1) - 1) / max(k - 1, 1),
+    }).sort_values('Total_PnL', ascending=False, ignore_index=True)
+    return corr_df, rolling_df, contrib_df, port_mdd
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def get_subset_optimization(snapshot, _df, levels=(0, 1)):
+    """策略子集最佳化 (以 snapshot 與權重格點為快取鍵)"""
+    mat = build_daily_pnl_matrix(_df)
+    strategy = _df['Strategy'].astype(str)
+    gains = _df['PnL'].clip(lower=0).groupby(strategy).sum().reindex(mat.columns, fill_value=0)
+    losses = (-_df['PnL'].clip(upper=0)).groupby(strategy).sum().reindex(mat.columns, fill_value=0)
+    return optimize_strategy_subsets(mat, gains.to_numpy(), losses.to_numpy(), levels)
+
+# 季節性維度：年 × 月 × 月內週次 (1~7 日為第 1 週) × 星期
+SEASON_DIMS = ('Year', 'Month', 'WeekOfMonth', 'Weekday')
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def get_seasonality(snapshot, _df):
+    """
+    季節性彙總引擎 (以 snapshot 為快取鍵)：日期拆成小整數後合成單一格位碼，
+    以 np.bincount 一次算出每格的損益、筆數、勝場、R 值與日層級勝率，之後任何維度組合都只需沿軸加總。
+    """
+    dates = _df['Date']
+    years = dates.dt.year.to_numpy()
+    y0 = int(years.min())
+    shape = (int(years.max()) - y0 + 1, 12, 5, 7)
+    size = int(np.prod(shape))
+    code = np.ravel_multi_index((years - y0, dates.dt.month.to_numpy() - 1, (dates.dt.day.to_numpy() - 1) // 7, dates.dt.dayofweek.to_numpy()), shape)
+
+    pnl = _df['PnL'].to_numpy(dtype='float64')
+    r = _df['R'].to_numpy(dtype='float64')
+    r_ok = ~np.isnan(r)
+    cells = {
+        'PnL': np.bincount(code, weights=pnl, minlength=size),
+        'Trades': np.bincount(code, minlength=size),
+        'Wins': np.bincount(code, weights=pnl > 0, minlength=size),
+        'R_Sum': np.bincount(code, weights=np.where(r_ok, r, 0), minlength=size),
+        'R_Count': np.bincount(code, weights=r_ok, minlength=size),
+    }
+
+    # 日層級：同一天的交易落在同一格，先彙總每日損益再計入
+    day_codes, days = pd.factorize(dates)
+    daily_pnl = np.bincount(day_codes, weights=pnl, minlength=len(days))
+    day_cell = np.zeros(len(days), dtype=code.dtype)
+    day_cell[day_codes] = code
+    cells['Days'] = np.bincount(day_cell, minlength=size)
+    cells['Win_Days'] = np.bincount(day_cell, weights=daily_pnl > 0, minlength=size)
+
+    return {'cells': {k: v.reshape(shape) for k, v in cells.items()}, 'years': list(range(y0, y0 + shape[0]))}
+
+def seasonality_breakdown(season, dims):
+    """沿未選維度加總，回傳指定維度組合的 總損益 / 筆數 / 勝率 / 期望值(R) / 日勝率 (只含有交易的格；星期以 0=Monday 編碼)"""
+    axes = tuple(i for i, d in enumerate(SEASON_DIMS) if d not in dims)
+    agg = {k: v.sum(axis=axes) for k, v in season['cells'].items()}
+    labels = {'Year': season['years'], 'Month': list(range(1, 13)), 'WeekOfMonth': list(range(1, 6)), 'Weekday': list(range(7))}
+    index = pd.MultiIndex.from_product([labels[d] for d in SEASON_DIMS if d in dims], names=[d for d in SEASON_DIMS if d in dims])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = pd.DataFrame({
+            'Total_PnL': agg['PnL'].ravel(),
+            'Trades': agg['Trades'].ravel(),
+            'Win_Rate': (agg['Wins'] / agg['Trades']).ravel(),
+            'Expectancy': (agg['R_Sum'] / agg['R_Count']).ravel(),
+            'Day_Win_Rate': (agg['Win_Days'] / agg['Days']).ravel(),
+        }, index=index)
+    return stats[stats['Trades'] > 0]
 
 # ==========================================
 # 1. 繪圖函式組
@@ -104,7 +200,7 @@ def plot_r_distribution(df):
 
 def plot_symbol_ranking(df):
     """標的排行榜 (獲利與虧損 Top 5)"""
-    symbol_stats = df.groupby('Symbol')['PnL'].sum().reset_index().sort_values('PnL', ascending=True)
+    symbol_stats = df.groupby('Symbol', observed=True)['PnL'].sum().reset_index().sort_values('PnL', ascending=True)
     # 取頭(虧損最慘 5)與尾(獲利最高 5)
     df_rank = pd.concat([symbol_stats.head(5), symbol_stats.tail(5)]).drop_duplicates().sort_values('PnL', ascending=True)
     colors = ['#ef5350' if x >= 0 else '#26a69a' for x in df_rank['PnL']]
@@ -118,7 +214,7 @@ def plot_symbol_ranking(df):
 
 # --- 其餘分析圖表保持原設計 ---
 def plot_strategy_performance(df):
-    stats = df.groupby('Strategy').agg(Total_PnL=('PnL', 'sum'), Count=('PnL', 'count'), Win_Count=('PnL', lambda x: (x > 0).sum())).reset_index()
+    stats = df.groupby('Strategy', observed=True).agg(Total_PnL=('PnL', 'sum'), Count=('PnL', 'count'), Win_Count=('PnL', lambda x: (x > 0).sum())).reset_index()
     stats['Win_Rate'] = stats['Win_Count'] / stats['Count']
     stats = stats.sort_values('Total_PnL', ascending=False)
     fig = go.Figure()
@@ -128,14 +224,15 @@ def plot_strategy_performance(df):
     return fig
 
 def plot_cumulative_pnl_by_strategy(df):
-    df_sorted = df.sort_values('Date')
-    df_sorted['CumPnL'] = df_sorted.groupby('Strategy')['PnL'].cumsum()
+    # 輸入為已排序的唯讀檢視，assign 只新增一欄，不複製整張表
+    df_sorted = df if df['Date'].is_monotonic_increasing else df.sort_values('Date', kind='stable')
+    df_sorted = df_sorted.assign(CumPnL=df_sorted.groupby('Strategy', observed=True)['PnL'].cumsum())
     fig = px.line(df_sorted, x='Date', y='CumPnL', color='Strategy', title="策略權益曲線")
     fig.update_layout(height=350)
     return fig
 
 def plot_strategy_quality_bubble(df):
-    stats = df.groupby('Strategy').apply(lambda x: pd.Series({
+    stats = df.groupby('Strategy', observed=True).apply(lambda x: pd.Series({
         'Win_Rate': (x['PnL'] > 0).mean(),
         'Avg_Win_R': x[x['R'] > 0]['R'].mean() if not x[x['R'] > 0].empty else 0,
         'Avg_Loss_R': abs(x[x['R'] <= 0]['R'].mean()) if not x[x['R'] <= 0].empty else 1,
@@ -154,36 +251,86 @@ def plot_win_loss_box(df):
     fig.update_layout(title="賺賠規模對比 (Box Plot)", height=350)
     return fig
 
-def plot_weekday_analysis(df):
-    cats = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-    df['Weekday'] = pd.Categorical(df['Weekday'], categories=cats, ordered=True)
-    daily_df = df.groupby(['Date', 'Weekday'], observed=True)['PnL'].sum().reset_index()
-    weekday_stats = daily_df.groupby('Weekday', observed=True).agg(Total_PnL=('PnL', 'sum'), Win_Rate=('PnL', lambda x: (x > 0).mean())).reset_index()
+def plot_weekday_analysis(season):
+    weekday_stats = seasonality_breakdown(season, ('Weekday',)).reset_index()
+    weekday_stats = weekday_stats[weekday_stats['Weekday'] < 5]
+    weekday_stats['Weekday'] = [WEEKDAYS[d] for d in weekday_stats['Weekday']]
     fig1 = go.Figure(go.Bar(x=weekday_stats['Weekday'], y=weekday_stats['Total_PnL'], marker_color=['#ef5350' if x >= 0 else '#26a69a' for x in weekday_stats['Total_PnL']]))
     fig1.update_layout(title="週一至週五：總損益表現", height=350)
-    fig2 = go.Figure(go.Bar(x=weekday_stats['Weekday'], y=weekday_stats['Win_Rate'], marker_color='#5c6bc0'))
+    fig2 = go.Figure(go.Bar(x=weekday_stats['Weekday'], y=weekday_stats['Day_Win_Rate'], marker_color='#5c6bc0'))
     fig2.update_layout(title="週一至週五：勝率 (以日計算)", height=350, yaxis_tickformat='.0%')
     return fig1, fig2
 
+# 季節性熱圖：(列維度, 欄維度, 標題)
+SEASON_HEATMAPS = [('Weekday', 'Month', "星期 × 月份"), ('WeekOfMonth', 'Weekday', "月內週次 × 星期"), ('Year', 'Month', "年度 × 月份")]
+SEASON_METRICS = {'Total_PnL': ("總損益", '$,.0f'), 'Win_Rate': ("勝率", '.0%'), 'Expectancy': ("期望值 (R)", '.2f'), 'Trades': ("交易次數", ',.0f')}
+
+def plot_seasonality_heatmap(season, row_dim, col_dim, metric, title):
+    """季節性熱圖 (由 seasonality_breakdown 沿軸加總而來，不再回頭掃交易)"""
+    grid = seasonality_breakdown(season, (row_dim, col_dim))[metric].unstack(col_dim)
+    label, fmt = SEASON_METRICS[metric]
+    fmt_labels = {'Month': lambda m: f"{m}月", 'WeekOfMonth': lambda w: f"第{w}週", 'Year': str, 'Weekday': lambda d: WEEKDAYS[d][:3]}
+    # 損益類指標以 0 為中心紅綠分色；勝率以 50% 為中心；次數單色
+    center = {'Total_PnL': 0, 'Expectancy': 0, 'Win_Rate': 0.5}.get(metric)
+    fig = go.Figure(go.Heatmap(
+        z=grid.values, x=[fmt_labels[col_dim](c) for c in grid.columns], y=[fmt_labels[row_dim](r) for r in grid.index],
+        colorscale=["#26a69a", "#eeeeee", "#ef5350"] if center is not None else "Blues", zmid=center,
+        texttemplate=f"%{{z:{fmt}}}", hovertemplate=f"%{{y}} %{{x}}<br>{label}: %{{z:{fmt}}}<extra></extra>"
+    ))
+    fig.update_layout(title=f"{title}：{label}", height=350, margin=dict(t=40, b=20, l=40, r=20), yaxis=dict(autorange='reversed', type='category'), xaxis=dict(type='category'))
+    return fig
+
+def plot_correlation_heatmap(corr_df):
+    """策略每日損益相關係數熱圖"""
+    fig = go.Figure(go.Heatmap(
+        z=corr_df.values, x=corr_df.columns, y=corr_df.index, zmin=-1, zmax=1,
+        colorscale=["#26a69a", "#eeeeee", "#ef5350"], text=corr_df.round(2).values, texttemplate="%{text}"
+    ))
+    fig.update_layout(title="策略每日損益相關係數", height=400, margin=dict(t=40, b=20, l=40, r=40))
+    return fig
+
+def plot_rolling_correlation(rolling_df, window):
+    """各策略與其餘組合的滾動相關係數"""
+    fig = go.Figure()
+    for strategy in rolling_df.columns:
+        fig.add_trace(go.Scatter(x=rolling_df.index, y=rolling_df[strategy], mode='lines', name=str(strategy)))
+    fig.add_hline(y=0, line_dash="dash", line_color="gray")
+    fig.update_layout(title=f"滾動相關係數 ({window} 個交易日，策略 vs 其餘組合)", height=400, yaxis=dict(range=[-1, 1]),
+                      margin=dict(t=40, b=20, l=40, r=40), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return fig
+
+def plot_subset_frontier(result):
+    """所有策略組合的 MDD × 總損益 散佈圖，Pareto 前緣另以紅點標示"""
+    rest, front = result[~result['Pareto']], result[result['Pareto']]
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=rest['MDD'], y=rest['Total_PnL'], mode='markers', name='其他組合', marker=dict(color='#bdbdbd', size=5),
+                               text=rest['Strategies'], hovertemplate="%{text}<br>MDD: $%{x:,.0f}<br>總損益: $%{y:,.0f}<extra></extra>"))
+    fig.add_trace(go.Scatter(x=front['MDD'], y=front['Total_PnL'], mode='markers', name='Pareto 前緣', marker=dict(color='#ef5350', size=9),
+                             text=front['Strategies'], hovertemplate="%{text}<br>MDD: $%{x:,.0f}<br>總損益: $%{y:,.0f}<extra></extra>"))
+    fig.update_layout(title="策略組合：最大回檔 vs 總損益", xaxis_title="MDD", yaxis_title="總損益", height=450,
+                      margin=dict(t=40, b=20, l=40, r=40), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return fig
+
 # ==========================================
 # 2. 局部刷新元件 (Fragments)
 # ==========================================
 
 @st.fragment
-def draw_strategy_section(df):
+def draw_strategy_section(df, snapshot):
     """策略分析獨立刷新區塊"""
     st.subheader("1️⃣ 策略效能深度檢閱")
-    all_strategies = sorted(df['Strategy'].unique().tolist())
+    all_strategies = sorted(df['Strategy'].unique().astype(str).tolist())
     selected_strategies = st.multiselect("🎯 篩選策略:", options=all_strategies, default=all_strategies)
     if not selected_strategies: st.warning("⚠️ 請至少勾選一個策略"); return
     df_filtered = df[df['Strategy'].isin(selected_strategies)]
+    params = tuple(sorted(selected_strategies))
     c1, c2, c3 = st.columns(3)
-    with c1: st.plotly_chart(plot_strategy_performance(df_filtered), use_container_width=True)
-    with c2: st.plotly_chart(plot_cumulative_pnl_by_strategy(df_filtered), use_container_width=True)
-    with c3: st.plotly_chart(plot_strategy_quality_bubble(df_filtered), use_container_width=True)
+    with c1: st.plotly_chart(cached_figure(snapshot, params, plot_strategy_performance, df_filtered), use_container_width=True)
+    with c2: st.plotly_chart(cached_figure(snapshot, params, plot_cumulative_pnl_by_strategy, df_filtered), use_container_width=True)
+    with c3: st.plotly_chart(cached_figure(snapshot, params, plot_strategy_quality_bubble, df_filtered), use_container_width=True)
 
 @st.fragment
-def draw_distribution_section(df):
+def draw_distribution_section(df, snapshot):
     """分佈圖獨立刷新區塊"""
     st.subheader("2️⃣ 整體損益分佈結構")
     dist_mode = st.radio("📊 切換分佈模式:", options=["損益金額 ($)", "R值單位 (R)"], horizontal=True, label_visibility="collapsed")
@@ -195,30 +342,100 @@ def draw_distribution_section(df):
     m3.metric("樣本總數", f"{len(df)} 筆")
     d1, d2 = st.columns(2)
     with d1: 
-        if dist_mode == "損益金額 ($)": st.plotly_chart(plot_pnl_distribution(df), use_container_width=True)
-        else: st.plotly_chart(plot_r_distribution(df), use_container_width=True)
-    with d2: st.plotly_chart(plot_win_loss_box(df), use_container_width=True)
+        if dist_mode == "損益金額 ($)": st.plotly_chart(cached_figure(snapshot, (), plot_pnl_distribution, df), use_container_width=True)
+        else: st.plotly_chart(cached_figure(snapshot, (), plot_r_distribution, df), use_container_width=True)
+    with d2: st.plotly_chart(cached_figure(snapshot, (), plot_win_loss_box, df), use_container_width=True)
+
+@st.fragment
+def draw_seasonality_section(season, snapshot):
+    """季節性熱圖獨立刷新區塊 (切換指標只重新加總格位，不重掃交易)"""
+    metric = st.radio("🗓️ 季節性指標:", options=list(SEASON_METRICS), format_func=lambda m: SEASON_METRICS[m][0], horizontal=True, key='season_metric')
+    cols = st.columns(len(SEASON_HEATMAPS))
+    for col, (row_dim, col_dim, title) in zip(cols, SEASON_HEATMAPS):
+        with col: st.plotly_chart(cached_figure(snapshot, (row_dim, col_dim, metric), plot_seasonality_heatmap, season, row_dim, col_dim, metric, title), use_container_width=True)
+
+@st.fragment
+def draw_correlation_section(df, snapshot):
+    """策略相關性與組合貢獻獨立刷新區塊"""
+    st.subheader("5️⃣ 策略相關性與組合貢獻")
+    if df['Strategy'].nunique() < 2: st.info("至少需要兩個策略才能計算相關性"); return
+    window = st.radio("📐 滾動視窗 (交易日):", options=[20, 60, 120], horizontal=True, key='corr_window')
+    corr_df, rolling_df, contrib_df, port_mdd = get_strategy_correlation(snapshot, df, window)
+
+    c1, c2 = st.columns(2)
+    with c1: st.plotly_chart(cached_figure(snapshot, (), plot_correlation_heatmap, corr_df), use_container_width=True)
+    with c2: st.plotly_chart(cached_figure(snapshot, (window,), plot_rolling_correlation, rolling_df, window), use_container_width=True)
+
+    st.caption(f"組合最大回檔 (MDD)：${port_mdd:,.0f}；「MDD 貢獻」為負代表該策略加深了組合回檔")
+    table = contrib_df.rename(columns={
+        'Strategy': '策略', 'Total_PnL': '總損益', 'PnL_Share': '損益占比', 'Vol_Contrib': '波動貢獻',
+        'Vol_Share': '波動占比', 'MDD_Without': '剔除後 MDD', 'MDD_Contrib': 'MDD 貢獻', 'Avg_Corr': '平均相關'
+    })
+    st.dataframe(table.style.format({
+        '總損益': '${:,.0f}', '損益占比': '{:.1%}', '波動貢獻': '${:,.0f}', '波動占比': '{:.1%}',
+        '剔除後 MDD': '${:,.0f}', 'MDD 貢獻': '${:,.0f}', '平均相關': '{:.2f}'
+    }), hide_index=True, use_container_width=True)
+
+# 權重格點選項與組合數上限
+SUBSET_GRIDS = {"全選 / 不選 (2^N)": (0, 1), "權重 0 / 0.5 / 1 (3^N)": (0, 0.5, 1)}
+MAX_SUBSET_COMBOS = 200_000
+
+@st.fragment
+def draw_portfolio_optimizer(df, snapshot):
+    """策略組合最佳化獨立刷新區塊"""
+    st.subheader("6️⃣ 策略組合最佳化")
+    n_strats = df['Strategy'].nunique()
+    if n_strats < 2: st.info("至少需要兩個策略才能比較組合"); return
+    grid = st.radio("⚖️ 權重格點:", options=list(SUBSET_GRIDS), horizontal=True, key='subset_grid')
+    levels = SUBSET_GRIDS[grid]
+    n_combos = len(levels) ** n_strats - 1
+    if n_combos > MAX_SUBSET_COMBOS:
+        # 只有 3^N 格點且 2^N 放得下時才建議改格點
+        hint = "請改用 2^N 格點或縮小日期區間" if len(levels) > 2 and 2 ** n_strats - 1 <= MAX_SUBSET_COMBOS else "請縮小日期區間以減少策略數"
+        st.warning(f"⚠️ {n_strats} 個策略共 {n_combos:,} 種組合，{hint}"); return
+    if not st.toggle(f"🚀 評估全部 {n_combos:,} 種組合", key='subset_run'): return
+
+    with st.spinner("組合評估中..."):
+        result = get_subset_optimization(snapshot, df, levels)
+    st.plotly_chart(cached_figure(snapshot, (levels,), plot_subset_frontier, result), use_container_width=True)
+
+    front = result[result['Pareto']].rename(columns={
+        'Rank': '排名', 'Strategies': '策略組合', 'N_Strategies': '策略數', 'Total_PnL': '總損益',
+        'MDD': '最大回檔', 'Profit_Factor': '獲利因子', 'R2': '穩定度 R²', 'Return_MDD': '損益 / MDD'
+    })
+    st.caption(f"Pareto 前緣 {len(front)} 組 (總損益、MDD、獲利因子、R² 皆無其他組合同時更佳)，依 損益 / MDD 排名")
+    st.dataframe(front[['排名', '策略組合', '策略數', '總損益', '最大回檔', '獲利因子', '穩定度 R²', '損益 / MDD']].style.format({
+        '排名': '{:.0f}', '總損益': '${:,.0f}', '最大回檔': '${:,.0f}', '獲利因子': '{:.2f}', '穩定度 R²': '{:.2f}', '損益 / MDD': '{:.2f}'
+    }), hide_index=True, use_container_width=True)
 
 # ==========================================
 # 3. 主入口
 # ==========================================
 
-def display_advanced_analysis(xls):
+def display_advanced_analysis(xls, date_range=None):
     st.markdown("### 🔍 交易細項深度分析")
     df, err = get_advanced_data(xls)
     if err: st.warning(f"⚠️ 無法進行分析: {err}"); return
+    df = slice_by_date(df, date_range)
     if df.empty: st.info("目前沒有交易資料。"); return
+    snapshot = snapshot_key(xls, date_range)
 
     st.markdown("---")
-    draw_strategy_section(df)
+    draw_strategy_section(df, snapshot)
     st.markdown("---")
-    draw_distribution_section(df)
+    draw_distribution_section(df, snapshot)
     st.markdown("---")
     st.subheader("3️⃣ 交易週期效應")
-    f1, f2 = plot_weekday_analysis(df)
+    season = get_seasonality(snapshot, df)
+    f1, f2 = cached_figure(snapshot, (), plot_weekday_analysis, season)
     dc1, dc2 = st.columns(2)
     with dc1: st.plotly_chart(f1, use_container_width=True)
     with dc2: st.plotly_chart(f2, use_container_width=True)
+    draw_seasonality_section(season, snapshot)
     st.markdown("---")
     st.subheader("4️⃣ 標的損益排行榜")
-    st.plotly_chart(plot_symbol_ranking(df), use_container_width=True)
+    st.plotly_chart(cached_figure(snapshot, (), plot_symbol_ranking, df), use_container_width=True)
+    st.markdown("---")
+    draw_correlation_section(df, snapshot)
+    st.markdown("---")
+    draw_portfolio_optimizer(df, snapshot)
@@ -3,6 +3,8 @@ import pandas as pd
 import numpy as np
 import calendar
 import plotly.graph_objects as go
+from utils import slice_by_date, clip_range, get_sheet_catalog, get_trade_table, table_view, WORKBOOK_HASH, sheet_cache_key, snapshot_key, cached_figure
+from logic_live import LIVE_REFRESH_SECONDS, get_live_folder, get_live_feed, merge_live_days
 
 # ==========================================
 # 0. UI 風格與 CSS 注入器 (集中管理樣式)
@@ -136,60 +138,35 @@ def clean_numeric(series):
     """將含有逗號的字串轉換為數字，錯誤則回傳 NaN"""
     return pd.to_numeric(series.astype(str).str.replace(',', '').str.strip(), errors='coerce')
 
+@st.cache_resource(ttl=60, max_entries=2, hash_funcs=WORKBOOK_HASH, show_spinner=False)
 def get_expectancy_data(xls):
-    """讀取期望值分頁"""
-    target_sheet = next((name for name in xls.sheet_names if "期望值" in name), None)
-    if not target_sheet: return None, "找不到含有 '期望值' 的分頁"
+    """從共用唯讀交易表取出有 R 值的交易 (每份快照全程序只篩選一次)"""
+    table, err = get_trade_table(xls)
+    if err: return None, err
+    return table_view(table, table['R'].notna()), None
+
+def read_daily_report_sheet(xls, sheet):
+    """讀取單一日報表分頁的 日期 / 當日損益 (第 1、8 欄)；尚未回報的日子保留 NaN，供即時交易判斷補上哪幾天"""
     try:
-        df = pd.read_excel(xls, sheet_name=target_sheet, header=14)
-        
-        # 定義 Excel 欄位名稱對應
-        mapping = {
-            '日期': 'Date',
-            '策略': 'Strategy',
-            '1R單位': 'Risk_Amount',
-            '損益': 'PnL',
-            '標準R(盈虧比)': 'R'
-        }
-        
-        existing_cols = [col for col in mapping.keys() if col in df.columns]
-        df_clean = df[existing_cols].copy().rename(columns={k: v for k, v in mapping.items() if k in df.columns})
-        
-        if 'Strategy' not in df_clean.columns: df_clean['Strategy'] = 'Standard'
-        if 'Date' in df_clean.columns: df_clean['Date'] = df_clean['Date'].ffill()
-        
-        df_clean = df_clean.dropna(subset=['Date'])
-        df_clean['Date'] = pd.to_datetime(df_clean['Date'], errors='coerce').dt.normalize()
-        
-        for col in ['Risk_Amount', 'PnL', 'R']:
-            if col in df_clean.columns:
-                df_clean[col] = clean_numeric(df_clean[col])
-        
-        df_clean = df_clean.dropna(subset=['PnL', 'R'])
-        return df_clean.sort_values('Date'), None
-    except Exception as e: return None, f"讀取期望值失敗: {e}"
-
-def get_daily_report_data(xls):
-    """讀取最新的兩個日報表"""
-    sheet_names = xls.sheet_names
-    daily_sheets = [s for s in sheet_names if "日報表" in s]
-    if not daily_sheets: return None, "找不到 '日報表'", "無"
-    daily_sheets.sort(reverse=True)
-    target_sheets = daily_sheets[:2]
-    all_dfs = []
-    for sheet in target_sheets:
-        try:
-            df = pd.read_excel(xls, sheet_name=sheet, header=4)
-            if df.shape[1] < 8: continue 
-            df_cal = df.iloc[:, [0, 7]].copy()
-            df_cal.columns = ['Date', 'DayPnL']
-            df_cal['Date'] = pd.to_datetime(df_cal['Date'], errors='coerce').dt.normalize()
-            df_cal = df_cal.dropna(subset=['Date'])
-            df_cal['DayPnL'] = clean_numeric(df_cal['DayPnL']).fillna(0)
-            all_dfs.append(df_cal)
-        except: continue
-    if not all_dfs: return None, "無效數據", "無"
-    return pd.concat(all_dfs, ignore_index=True).sort_values('Date'), None, ""
+        df = pd.read_excel(xls, sheet_name=sheet, header=4)
+        if df.shape[1] < 8: return None
+        df_cal = df.iloc[:, [0, 7]].copy()
+        df_cal.columns = ['Date', 'DayPnL']
+        df_cal['Date'] = pd.to_datetime(df_cal['Date'], errors='coerce').dt.normalize()
+        df_cal = df_cal.dropna(subset=['Date'])
+        df_cal['DayPnL'] = clean_numeric(df_cal['DayPnL'])
+        return df_cal.sort_values('Date', ignore_index=True)
+    except: return None
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _load_daily_report_sheet(sheet_key, sheet, _xls):
+    # 以分頁內容指紋 (含共用字串 / 樣式) 為鍵：活頁簿重新下載但該月未變動時直接沿用
+    return read_daily_report_sheet(_xls, sheet)
+
+def load_daily_report_month(xls, year, month):
+    """依分頁索引延遲載入任一月份的日報表 (每個分頁內容只讀一次，所有 session 與快照共用)"""
+    sheet = get_sheet_catalog(xls).sheet(year, month)
+    return _load_daily_report_sheet(sheet_cache_key(xls, sheet), sheet, xls) if sheet else None
 
 def calculate_streaks(df):
     pnl = df['PnL'].values
@@ -221,12 +198,13 @@ def calculate_kpis(df):
     }
 
 def calculate_trends(df):
-    df = df.reset_index(drop=True).copy()
-    df['Running_EV'] = df['R'].expanding().mean()
-    df['Running_PF'] = (df['PnL'].apply(lambda x: x if x > 0 else 0).cumsum() / 
-                        df['PnL'].apply(lambda x: abs(x) if x <= 0 else 0).cumsum().replace(0, np.nan)).fillna(1)
-    df['Running_RSQ'] = df['R'].cumsum().expanding(min_periods=3).corr(pd.Series(df.index)) ** 2
-    return df.fillna(0)
+    # 只建立走勢圖需要的欄位，不複製整張交易表
+    r, pnl = df['R'].reset_index(drop=True), df['PnL'].reset_index(drop=True)
+    trends = pd.DataFrame({'Date': df['Date'].to_numpy()})
+    trends['Running_EV'] = r.expanding().mean()
+    trends['Running_PF'] = (pnl.clip(lower=0).cumsum() / (-pnl.clip(upper=0)).cumsum().replace(0, np.nan)).fillna(1)
+    trends['Running_RSQ'] = r.cumsum().expanding(min_periods=3).corr(pd.Series(trends.index)) ** 2
+    return trends.fillna(0)
 
 # ==========================================
 # 2. 繪圖與 UI 元件
@@ -246,18 +224,18 @@ def get_sparkline(df_t, col_name, color):
     return fig
 
 @st.fragment
-def draw_kpi_cards_with_charts(kpi, df_t):
+def draw_kpi_cards_with_charts(kpi, df_t, snapshot):
     c1, c2, c3, c4, c5 = st.columns(5)
     with c1: st.metric("總損益", f"${kpi['Total PnL']:,.0f}"); st.write("")
     with c2: 
         st.metric("期望值", f"{kpi['Expectancy']:.3f} R")
-        st.plotly_chart(get_sparkline(df_t, 'Running_EV', '#FF8A65'), use_container_width=True, config={'displayModeBar': False})
+        st.plotly_chart(cached_figure(snapshot, ('Running_EV', '#FF8A65'), get_sparkline, df_t, 'Running_EV', '#FF8A65'), use_container_width=True, config={'displayModeBar': False})
     with c3:
         st.metric("獲利因子", f"{kpi['Profit Factor']:.2f}")
-        st.plotly_chart(get_sparkline(df_t, 'Running_PF', '#BA68C8'), use_container_width=True, config={'displayModeBar': False})
+        st.plotly_chart(cached_figure(snapshot, ('Running_PF', '#BA68C8'), get_sparkline, df_t, 'Running_PF', '#BA68C8'), use_container_width=True, config={'displayModeBar': False})
     with c4:
         st.metric("盈虧比 (R)", f"{kpi['Payoff Ratio']:.2f}")
-        st.plotly_chart(get_sparkline(df_t, 'Running_EV', '#4DB6AC'), use_container_width=True, config={'displayModeBar': False})
+        st.plotly_chart(cached_figure(snapshot, ('Running_EV', '#4DB6AC'), get_sparkline, df_t, 'Running_EV', '#4DB6AC'), use_container_width=True, config={'displayModeBar': False})
     with c5: st.metric("勝率", f"{kpi['Win Rate']*100:.1f}%"); st.write("")
 
     st.write("") 
@@ -267,7 +245,7 @@ def draw_kpi_cards_with_charts(kpi, df_t):
     d3.metric("最大連敗", f"{kpi['Max Loss Streak']} 次")
     with d4:
         st.metric("穩定度 R²", f"{kpi['R Squared']:.2f}")
-        st.plotly_chart(get_sparkline(df_t, 'Running_RSQ', '#9575CD'), use_container_width=True, config={'displayModeBar': False})
+        st.plotly_chart(cached_figure(snapshot, ('Running_RSQ', '#9575CD'), get_sparkline, df_t, 'Running_RSQ', '#9575CD'), use_container_width=True, config={'displayModeBar': False})
     d5.empty()
 
 @st.fragment
@@ -283,18 +261,23 @@ def draw_kelly_fragment(kpi):
     with c_center[4]: st.metric("建議單筆風險", f"${capital * adj_kelly:,.0f}")
 
 @st.fragment
-def draw_calendar_fragment(df_cal, theme_mode):
-    if df_cal is None or df_cal.empty: st.warning("無日報表資料"); return
-    df_cal['DateStr'] = df_cal['Date'].dt.strftime('%Y-%m-%d')
-    daily_pnl_map = df_cal.groupby('DateStr')['DayPnL'].sum().to_dict()
-    unique_months = df_cal['Date'].dt.to_period('M').drop_duplicates().sort_values(ascending=False)
+def draw_calendar_fragment(xls, months, theme_mode, date_range=None, live_days=None):
+    if not months: st.warning("無日報表資料"); return
+    periods = [pd.Period(year=y, month=m, freq='M') for y, m in months]
     
     st.markdown("---")
     c_sel, _ = st.columns([1, 4])
-    with c_sel: sel_period = st.selectbox("選擇月份", unique_months, index=0, key='cal_month_selector', label_visibility="collapsed")
+    with c_sel: sel_period = st.selectbox("選擇月份", periods, index=0, key='cal_month_selector', label_visibility="collapsed")
     
+    # 只載入選定月份的分頁，並疊上日報表尚未涵蓋的即時交易日
     y, m = sel_period.year, sel_period.month
-    df_month = df_cal[(df_cal['Date'].dt.year == y) & (df_cal['Date'].dt.month == m)].sort_values('Date')
+    month_start, month_end = sel_period.start_time, sel_period.end_time.normalize()
+    df_month = slice_by_date(load_daily_report_month(xls, y, m), clip_range(date_range, month_start, month_end))
+    if live_days:
+        df_month = merge_live_days(df_month, {d: v for d, v in live_days.items() if month_start <= d <= month_end})
+    if df_month is None: df_month = pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'DayPnL': pd.Series(dtype='float64')})
+    df_month = df_month.assign(DayPnL=df_month['DayPnL'].fillna(0))
+    daily_pnl_map = df_month.groupby(df_month['Date'].dt.strftime('%Y-%m-%d'))['DayPnL'].sum().to_dict()
     m_pnl = df_month['DayPnL'].sum()
 
     if not df_month.empty:
@@ -350,15 +333,41 @@ def draw_calendar_fragment(df_cal, theme_mode):
     html += "</tbody></table></div>"
     st.markdown(html, unsafe_allow_html=True)
 
-def display_expectancy_lab(xls):
+def display_expectancy_lab(xls, date_range=None):
     chart_theme = inject_custom_css()
     df_kpi, err_kpi = get_expectancy_data(xls)
-    df_cal, _, _ = get_daily_report_data(xls)
     if err_kpi: st.warning(f"KPI 讀取錯誤: {err_kpi}"); return
+    df_kpi = slice_by_date(df_kpi, date_range)
     if df_kpi is None or df_kpi.empty: st.info("無資料"); return
+    snapshot = snapshot_key(xls, date_range)
+    # 日曆可選的月份來自分頁索引，實際資料等選定後才載入
+    cal_months = get_sheet_catalog(xls).months(date_range)
+
+    # 設定了投遞資料夾時改走即時模式：KPI 由增量狀態提供，定時只刷新這個區塊
+    live_folder = get_live_folder()
+    if live_folder:
+        feed = get_live_feed(live_folder, snapshot, df_kpi, date_range)
+        draw_live_lab_fragment(feed, xls, cal_months, date_range, snapshot, chart_theme)
+        return
+
     kpi = calculate_kpis(df_kpi)
     df_trends = calculate_trends(df_kpi)
-    draw_kpi_cards_with_charts(kpi, df_trends)
+    draw_lab_body(kpi, df_trends, snapshot, chart_theme)
+    draw_calendar_fragment(xls, cal_months, chart_theme, date_range)
+
+def draw_lab_body(kpi, df_trends, snapshot, chart_theme):
+    draw_kpi_cards_with_charts(kpi, df_trends, snapshot)
     st.markdown("---")
     draw_kelly_fragment(kpi)
-    draw_calendar_fragment(df_cal, chart_theme)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def draw_live_lab_fragment(feed, xls, cal_months, date_range, snapshot, chart_theme):
+    """即時模式：輪詢投遞資料夾，只對新交易做 O(1) 更新後重繪本區塊"""
+    feed.poll()
+    kpi, df_trends, daily_totals = feed.view()
+    st.caption(f"🟢 即時更新中：已匯入 {feed.live_count} 筆投遞交易 (每 {LIVE_REFRESH_SECONDS} 秒檢查)")
+    draw_lab_body(kpi, df_trends, f"{snapshot}|live{kpi['Total Trades']}", chart_theme)
+    # 日報表分頁尚未建立的新月份，由即時交易日補進月份清單
+    latest = cal_months[0] if cal_months else (0, 0)
+    live_months = sorted({(d.year, d.month) for d in daily_totals if (d.year, d.month) > latest}, reverse=True)
+    draw_calendar_fragment(xls, live_months + cal_months, chart_theme, date_range, daily_totals)
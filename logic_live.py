@@ -0,0 +1,248 @@
+import os
+import io
+import csv
+import json
+import glob
+import math
+import threading
+from collections import Counter
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+from utils import TRADE_COLUMNS
+
+# 開啟中的儀表板多久輪詢一次資料夾 (秒)
+LIVE_REFRESH_SECONDS = 10
+# KPI 走勢圖只顯示最後 50 筆
+SPARKLINE_TAIL = 50
+
+# ==========================================
+# 0. 增量 KPI 狀態 (每筆交易 O(1) 更新)
+# ==========================================
+
+class LiveKPIState:
+    """
+    以累加量維護 calculate_kpis / calculate_trends 的所有指標，
+    新交易進來只更新計數與總和，不回頭重算整段歷史。
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.total_pnl = 0.0
+        self.n_wins = 0
+        self.win_pnl = self.loss_pnl = 0.0
+        self.r_sum = 0.0
+        self.n_r_pos = self.n_r_nonpos = 0
+        self.r_pos_sum = self.r_nonpos_sum = 0.0
+        self.curr_win = self.curr_loss = self.max_win = self.max_loss = 0
+        # R² 用：x = 交易序號，y = 累積 R
+        self.cum_r = 0.0
+        self.sx = self.sxx = self.sy = self.syy = self.sxy = 0.0
+        self.daily_totals = {}
+        self.trend_rows = []
+
+    def _r_squared(self):
+        n = self.n
+        var_x = n * self.sxx - self.sx ** 2
+        var_y = n * self.syy - self.sy ** 2
+        if var_x <= 0 or var_y <= 0: return float('nan')
+        return (n * self.sxy - self.sx * self.sy) ** 2 / (var_x * var_y)
+
+    def add(self, date, pnl, r):
+        x = float(self.n)
+        self.n += 1
+        self.total_pnl += pnl
+        self.r_sum += r
+
+        if pnl > 0:
+            self.n_wins += 1; self.win_pnl += pnl
+            self.curr_win += 1; self.curr_loss = 0; self.max_win = max(self.max_win, self.curr_win)
+        else:
+            self.loss_pnl += abs(pnl)
+            self.curr_loss += 1; self.curr_win = 0; self.max_loss = max(self.max_loss, self.curr_loss)
+        if r > 0: self.n_r_pos += 1; self.r_pos_sum += r
+        else: self.n_r_nonpos += 1; self.r_nonpos_sum += r
+
+        self.cum_r += r
+        self.sx += x; self.sxx += x * x
+        self.sy += self.cum_r; self.syy += self.cum_r ** 2; self.sxy += x * self.cum_r
+
+        self.daily_totals[date] = self.daily_totals.get(date, 0.0) + pnl
+
+        # 與 calculate_trends 相同的定義：PF 無虧損時為 1、R² 前 3 筆為 0
+        running_pf = self.win_pnl / self.loss_pnl if self.loss_pnl else 1.0
+        running_rsq = self._r_squared() if self.n >= 3 else 0.0
+        self.trend_rows.append((date, self.r_sum / self.n, running_pf, 0.0 if math.isnan(running_rsq) else running_rsq))
+
+    def kpis(self):
+        """回傳與 calculate_kpis 相同鍵值的字典"""
+        n = self.n
+        n_losses = n - self.n_wins
+        win_rate = self.n_wins / n if n > 0 else 0
+        avg_win_r = (self.r_pos_sum / self.n_r_pos if self.n_r_pos else float('nan')) if self.n_wins > 0 else 0
+        avg_loss_r = (abs(self.r_nonpos_sum / self.n_r_nonpos) if self.n_r_nonpos else float('nan')) if n_losses > 0 else 1
+        payoff_r = avg_win_r / avg_loss_r if avg_loss_r > 0 else 0
+        pf = self.win_pnl / self.loss_pnl if self.loss_pnl != 0 else float('inf')
+        r_sq = self._r_squared() if n >= 2 else 0
+        full_kelly = (win_rate - (1 - win_rate) / payoff_r) if payoff_r > 0 else 0
+        return {
+            "Total PnL": self.total_pnl, "Total Trades": n, "Win Rate": win_rate,
+            "Payoff Ratio": payoff_r, "Profit Factor": pf, "Expectancy": self.r_sum / n if n > 0 else float('nan'),
+            "Max Win Streak": self.max_win, "Max Loss Streak": self.max_loss, "R Squared": r_sq, "Full Kelly": full_kelly
+        }
+
+    def trends(self, tail=SPARKLINE_TAIL):
+        """最後 tail 筆的 Running_EV / Running_PF / Running_RSQ，欄位同 calculate_trends"""
+        return pd.DataFrame(self.trend_rows[-tail:], columns=['Date', 'Running_EV', 'Running_PF', 'Running_RSQ'])
+
+# ==========================================
+# 1. 交易投遞資料夾 (CSV / JSON Lines 追加讀取，JSON 整檔讀取)
+# ==========================================
+
+# 同時接受期望值分頁的中文欄名與內部英文欄名
+FIELD_ALIASES = {**TRADE_COLUMNS, **{v: v for v in TRADE_COLUMNS.values()}}
+
+def parse_trade_record(raw):
+    """將一筆投遞紀錄轉成 (Date, Strategy, Symbol, PnL, R)，缺日期 / 損益 / R 時回傳 None"""
+    rec = {FIELD_ALIASES[k.strip()]: v for k, v in raw.items() if k and k.strip() in FIELD_ALIASES}
+    try:
+        date = pd.Timestamp(rec['Date']).normalize()
+        pnl = float(str(rec['PnL']).replace(',', '').strip())
+        r = float(str(rec['R']).replace(',', '').strip())
+    except (KeyError, ValueError, TypeError): return None
+    if pd.isna(date) or math.isnan(pnl) or math.isnan(r): return None
+    return date, str(rec.get('Strategy') or '未分類'), str(rec.get('Symbol') or '未知標的'), pnl, r
+
+class TradeDropFolder:
+    """
+    監看資料夾中的 *.csv / *.jsonl，記住每個檔案讀到的位元組位置，
+    每次輪詢只讀新追加的完整行 (尚未寫完的最後一行留待下次)。
+    *.json 為完整文件 (單一物件或物件陣列)，大小或修改時間變動時整檔重讀，只回傳新增的紀錄。
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.offsets = {}
+        self.headers = {}
+        # *.json：(大小, 修改時間) 與已回傳的紀錄數
+        self.signatures = {}
+        self.doc_counts = {}
+
+    def _read_new_objects(self, path):
+        info = os.stat(path)
+        sig = (info.st_size, info.st_mtime_ns)
+        if self.signatures.get(path) == sig: return []
+        with open(path, 'rb') as f:
+            try: doc = json.loads(f.read().decode('utf-8-sig'))
+            except ValueError: return []  # 尚未寫完，維持舊簽章待下次重讀
+        self.signatures[path] = sig
+        objs = [o for o in (doc if isinstance(doc, list) else [doc]) if isinstance(o, dict)]
+        done = self.doc_counts.get(path, 0)
+        if len(objs) < done: done = 0  # 檔案被改寫成較短內容，視為新檔
+        self.doc_counts[path] = len(objs)
+        return objs[done:]
+
+    def _read_new_lines(self, path):
+        size = os.path.getsize(path)
+        offset = self.offsets.get(path, 0)
+        if size < offset: offset = 0; self.headers.pop(path, None)  # 檔案被截斷或重建
+        if size == offset: return []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(size - offset)
+        end = chunk.rfind(b'\n') + 1
+        self.offsets[path] = offset + end
+        return chunk[:end].decode('utf-8-sig').splitlines()
+
+    def poll(self):
+        """回傳自上次輪詢後新增的交易紀錄 (依檔名、行序)"""
+        records = []
+        paths = sorted(p for ext in ('*.csv', '*.json', '*.jsonl') for p in glob.glob(os.path.join(self.folder, ext)))
+        for path in paths:
+            if path.endswith('.json'):
+                try: rows = self._read_new_objects(path)
+                except OSError: continue
+                records.extend(rec for rec in map(parse_trade_record, rows) if rec)
+                continue
+            try: lines = self._read_new_lines(path)
+            except OSError: continue
+            if path.endswith('.csv'):
+                if path not in self.headers and lines: self.headers[path] = next(csv.reader([lines.pop(0)]))
+                rows = csv.DictReader(io.StringIO("\n".join(lines)), fieldnames=self.headers.get(path)) if lines else []
+            else:
+                rows = []
+                for line in lines:
+                    try: obj = json.loads(line)
+                    except ValueError: continue
+                    if isinstance(obj, dict): rows.append(obj)
+            records.extend(rec for rec in map(parse_trade_record, rows) if rec)
+        return records
+
+# ==========================================
+# 2. 即時資料流 (種子 = 活頁簿交易，之後逐筆追加)
+# ==========================================
+
+def dedupe_key(date, strategy, symbol, pnl):
+    # 活頁簿損益存成 float32，投遞檔的損益先轉成同樣精度再取小數兩位，兩邊的鍵才會一致
+    return date, strategy, symbol, round(float(np.float32(pnl)), 2)
+
+class LiveTradeFeed:
+    """活頁簿交易作為起點，再逐筆疊加投遞資料夾的新交易；全程序共用，輪詢以鎖保護"""
+
+    def __init__(self, folder, seed_df, date_range=None):
+        self.watcher = TradeDropFolder(folder)
+        self.state = LiveKPIState()
+        self.date_range = date_range
+        self.live_count = 0
+        self.lock = threading.Lock()
+        # 已寫進活頁簿的交易若仍留在投遞檔中，依 (日期, 策略, 標的, 損益) 扣除避免重複計入
+        self.seen = Counter()
+        dates = seed_df['Date'].to_numpy()
+        pnl, r = seed_df['PnL'].to_numpy(dtype='float64'), seed_df['R'].to_numpy(dtype='float64')
+        for d, s, sym, p, rv in zip(dates, seed_df['Strategy'].astype(str), seed_df['Symbol'].astype(str), pnl, r):
+            d = pd.Timestamp(d)
+            self.state.add(d, p, rv)
+            self.seen[dedupe_key(d, s, sym, p)] += 1
+
+    def poll(self):
+        """讀取新交易並增量更新 KPI，回傳本次新增筆數"""
+        with self.lock:
+            added = 0
+            for date, strategy, symbol, pnl, r in self.watcher.poll():
+                if self.date_range and not (self.date_range[0] <= date <= self.date_range[1]): continue
+                key = dedupe_key(date, strategy, symbol, pnl)
+                if self.seen[key] > 0: self.seen[key] -= 1; continue
+                self.state.add(date, pnl, r)
+                added += 1
+            self.live_count += added
+            return added
+
+    def view(self):
+        """目前的 KPI 字典、走勢圖資料與每日損益合計"""
+        with self.lock:
+            return self.state.kpis(), self.state.trends(), dict(self.state.daily_totals)
+
+def get_live_folder():
+    """Streamlit Secrets 中的 'live_trade_folder'，未設定時回傳 None"""
+    try: folder = st.secrets.get("live_trade_folder")
+    except Exception: return None
+    return folder if folder and os.path.isdir(folder) else None
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_live_feed(folder, snapshot, _seed_df, _date_range=None):
+    """每個 (資料夾, 快照) 只建立一次即時資料流，所有 session 共用"""
+    return LiveTradeFeed(folder, _seed_df, _date_range)
+
+def merge_live_days(df_cal, daily_totals):
+    """
+    日報表最後一個有回報值的日期之後，以即時交易的每日合計補上 (供日曆使用)。
+    日報表會預填到月底，未回報的日子 DayPnL 為 NaN，這些列由即時合計取代。
+    """
+    reported = df_cal.loc[df_cal['DayPnL'].notna(), 'Date'] if df_cal is not None else None
+    last = reported.max() if reported is not None and not reported.empty else None
+    extra = {d: v for d, v in daily_totals.items() if last is None or d > last}
+    if not extra: return df_cal
+    df_live = pd.DataFrame({'Date': list(extra), 'DayPnL': np.array(list(extra.values()))})
+    if df_cal is None: return df_live.sort_values('Date', ignore_index=True)
+    return pd.concat([df_cal[~df_cal['Date'].isin(df_live['Date'])], df_live], ignore_index=True).sort_values('Date', ignore_index=True)
@@ -0,0 +1,118 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+# 每個批次評估的組合數 (日期數 × 批次大小 的 float64 矩陣，約數十 MB)
+CHUNK_SIZE = 2048
+# 少於此組合數時直接在本程序計算，省去行程池啟動成本
+POOL_MIN_COMBOS = 4 * CHUNK_SIZE
+
+# ==========================================
+# 0. 批次矩陣評估 (行程池工作函式)
+# ==========================================
+
+_WORKER = {}
+
+def _init_worker(X, gains, losses, levels):
+    # 行程池初始化時只傳一次每日損益矩陣，之後各批次只傳索引範圍
+    _WORKER.update(X=X, gains=gains, losses=losses, levels=levels)
+
+def combo_weights(start, stop, n_strats, levels):
+    """組合編號 → 權重矩陣 (策略數 × 組合數)；編號以 len(levels) 進位逐位對應各策略，二元權重即位元遮罩"""
+    idx = np.arange(start, stop)
+    digits = (idx[None, :] // (len(levels) ** np.arange(n_strats))[:, None]) % len(levels)
+    return np.asarray(levels, dtype='float64')[digits]
+
+def evaluate_chunk(X, gains, losses, levels, start, stop):
+    """一次矩陣乘法算出整批組合的每日損益，再向量化求 總損益 / MDD / 獲利因子 / R²"""
+    W = combo_weights(start, stop, X.shape[1], levels)
+    cum = np.cumsum(X @ W, axis=0)
+    total = cum[-1]
+    mdd = (cum - np.maximum.accumulate(cum, axis=0)).min(axis=0)
+
+    # 獲利因子以交易層級計：各策略的總獲利 / 總虧損依權重加總
+    win, loss = gains @ W, losses @ W
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pf = np.where(loss > 0, win / loss, np.inf)
+
+        # R²：累積損益曲線 vs. 日期序號的相關係數平方
+        t = np.arange(len(cum), dtype='float64')
+        tc = t - t.mean()
+        yc = cum - cum.mean(axis=0)
+        r2 = (tc @ yc) ** 2 / ((tc @ tc) * (yc * yc).sum(axis=0))
+    return np.column_stack([total, mdd, pf, np.nan_to_num(r2)])
+
+def _evaluate_in_worker(bounds):
+    w = _WORKER
+    return evaluate_chunk(w['X'], w['gains'], w['losses'], w['levels'], *bounds)
+
+# ==========================================
+# 1. Pareto 前緣
+# ==========================================
+
+def pareto_mask(scores, block=256):
+    """
+    scores 每欄皆為越大越好；回傳非支配點的布林遮罩。
+    先依各欄字典序由大到小排序 (後面的點不可能支配前面的點)，
+    再逐批與「目前前緣 + 同批點」做向量化支配比較。
+    """
+    order = np.lexsort(-scores.T[::-1])
+    front = np.empty(0, dtype=int)
+    for b in range(0, len(order), block):
+        idx = order[b:b + block]
+        cand = scores[idx]
+        ref = np.vstack([scores[front], cand])
+        dominated = ((ref[:, None, :] >= cand[None, :, :]).all(axis=2) & (ref[:, None, :] > cand[None, :, :]).any(axis=2)).any(axis=0)
+        front = np.concatenate([front, idx[~dominated]])
+    mask = np.zeros(len(scores), dtype=bool)
+    mask[front] = True
+    return mask
+
+# ==========================================
+# 2. 主函式
+# ==========================================
+
+def optimize_strategy_subsets(mat, gains, losses, levels=(0, 1), max_workers=None):
+    """
+    mat 為 日期 × 策略 的每日損益矩陣，gains / losses 為各策略交易層級的總獲利與總虧損(正值)。
+    評估所有權重組合 (levels=(0, 1) 即 2^N 個子集)，回傳每個組合的指標與 Pareto 前緣排名。
+    """
+    X = mat.to_numpy(dtype='float64')
+    gains = np.asarray(gains, dtype='float64')
+    losses = np.asarray(losses, dtype='float64')
+    n_strats = X.shape[1]
+    # 編號 0 為全部權重為 0 的空組合，略過
+    n_combos = len(levels) ** n_strats
+    bounds = [(s, min(s + CHUNK_SIZE, n_combos)) for s in range(1, n_combos, CHUNK_SIZE)]
+
+    if n_combos < POOL_MIN_COMBOS or max_workers == 1:
+        parts = [evaluate_chunk(X, gains, losses, levels, *b) for b in bounds]
+    else:
+        # Streamlit 以多執行緒服務 session，改用 spawn 避免 fork 帶走其他執行緒的鎖
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=ctx, initializer=_init_worker, initargs=(X, gains, losses, levels)) as pool:
+            parts = list(pool.map(_evaluate_in_worker, bounds))
+    metrics = np.vstack(parts)
+
+    W = combo_weights(1, n_combos, n_strats, levels)
+    names = [str(c) for c in mat.columns]
+    labels = [" + ".join(n if w == 1 else f"{n}×{w:g}" for n, w in zip(names, col) if w != 0) for col in W.T.tolist()]
+
+    result = pd.DataFrame({
+        'Strategies': labels,
+        'N_Strategies': (W != 0).sum(axis=0),
+        'Total_PnL': metrics[:, 0],
+        'MDD': metrics[:, 1],
+        'Profit_Factor': metrics[:, 2],
+        'R2': metrics[:, 3],
+    })
+    # 目標：總損益↑、MDD↑ (越接近 0 越好)、獲利因子↑、R²↑
+    result['Pareto'] = pareto_mask(np.nan_to_num(metrics, posinf=np.finfo('float64').max))
+    # 前緣內以 總損益 / |MDD| 排名
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['Return_MDD'] = np.where(result['MDD'] < 0, result['Total_PnL'] / -result['MDD'], np.inf)
+    result['Rank'] = result['Return_MDD'].where(result['Pareto']).rank(ascending=False, method='min')
+    return result.sort_values(['Pareto', 'Return_MDD'], ascending=[False, False], ignore_index=True)
@@ -1,37 +1,38 @@
 import pandas as pd
 import plotly.graph_objects as go
-import re
 from datetime import datetime
-from utils import read_daily_pnl, insert_zero_crossings # 確保從 utils 引用功能
+from utils import load_daily_pnl, insert_zero_crossings, slice_by_date, clip_range, get_sheet_catalog # 確保從 utils 引用功能
 
-def get_yearly_data_and_chart(xls, year):
+def get_yearly_data_and_chart(xls, year, date_range=None):
     """
     負責處理單一年度的所有數據計算與繪圖，回傳 KPI 與 Figure 物件。
+    date_range 為全域日期區間，只讀取與區間重疊的月份分頁。
     """
-    sheet_map = {re.sub(r"[ _－/.-]", "", str(n)): n for n in xls.sheet_names}
+    year_range = clip_range(date_range, f"{year}-01-01", f"{year}-12-31")
+    if year_range is None: return None
+
+    catalog = get_sheet_catalog(xls)
     all_data = []
 
-    for m in range(1, 13):
-        targets = [f"日報表{year}{m:02d}", f"日報表{year}{m}"]
-        real_name = next((sheet_map[t] for t in targets if t in sheet_map), None)
+    for m in range(year_range[0].month, year_range[1].month + 1):
+        real_name = catalog.sheet(year, m)
         if real_name:
-            df_m = read_daily_pnl(xls, real_name)
+            df_m = load_daily_pnl(xls, real_name)
             if not df_m.empty: all_data.append(df_m)
     
     if not all_data: return None
 
-    df_year = pd.concat(all_data)
-    df_year = df_year[df_year['Date'].dt.year == year]
+    df_year = pd.concat(all_data).sort_values('Date')
     
-    # 未來過濾邏輯
+    # 年度與全域區間切片 + 未來過濾邏輯
     current_year = datetime.now().year
     if year == current_year:
-        df_year = df_year[df_year['Date'] <= pd.Timestamp.now().normalize()]
+        year_range = (year_range[0], min(year_range[1], pd.Timestamp.now().normalize()))
+    df_year = slice_by_date(df_year, year_range)
     
     if df_year.empty: return None
 
-    df_year = df_year.sort_values('Date')
-    df_year['Cumulative_PnL'] = df_year['Daily_PnL'].cumsum()
+    df_year = df_year.assign(Cumulative_PnL=df_year['Daily_PnL'].cumsum())
     
     # KPI 計算
     latest_pnl = df_year['Cumulative_PnL'].iloc[-1]
@@ -1,28 +1,134 @@
 # utils.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 import time
 import re
+import io
+import sys
+import hashlib
+import urllib.request
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from datetime import date
+import plotly.graph_objects as go
+
+# 共用唯讀表依賴 Copy-on-Write：session 端的任何修改只會產生自己的副本 (pandas 3 起為預設)
+if int(pd.__version__.split('.')[0]) < 3: pd.set_option("mode.copy_on_write", True)
 
 # --- 連線設定 ---
 @st.cache_resource(ttl=60)
 def load_google_sheet():
-    """從 Google Cloud 下載 Excel 檔案"""
+    """從 Google Cloud 下載 Excel 檔案，並以內容雜湊標記快照 (xls.fingerprint)；xls.source 為原始內容的獨立緩衝區供分頁索引使用"""
     try:
         if "google_sheet_id" not in st.secrets:
             return None, "請在 Streamlit Secrets 設定 'google_sheet_id'"
         
         sheet_id = st.secrets["google_sheet_id"]
         url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx&t={int(time.time())}"
+        with urllib.request.urlopen(url) as resp: content = resp.read()
         
-        return pd.ExcelFile(url, engine='openpyxl'), None
+        xls = pd.ExcelFile(io.BytesIO(content), engine='openpyxl')
+        xls.fingerprint = hashlib.sha1(content).hexdigest()
+        # 分頁索引另開緩衝區，不與 openpyxl 共用讀取位置
+        xls.source = io.BytesIO(content)
+        return xls, None
     except Exception as e:
         return None, f"無法讀取雲端檔案: {e}"
 
+def workbook_fingerprint(xls):
+    """快取鍵：同一份活頁簿內容在所有 session 之間共用同一個鍵"""
+    return getattr(xls, 'fingerprint', None) or f"id-{id(xls)}"
+
+# st.cache_* 遇到 ExcelFile 參數時改用內容雜湊
+WORKBOOK_HASH = {pd.ExcelFile: workbook_fingerprint}
+
 # --- 資料清洗小幫手 ---
 def clean_numeric_column(series):
     return pd.to_numeric(series.astype(str).str.replace(',', '').str.strip(), errors='coerce')
 
+# --- 分頁索引 (每份活頁簿只建一次) ---
+DAILY_SHEET_PATTERN = re.compile(r"日報表(\d{4})(\d{1,2})?")
+XLSX_NS = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+XLSX_RID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+# 各分頁共用、分頁 XML 只以索引引用的部分
+XLSX_SHARED_PARTS = ('xl/sharedStrings.xml', 'xl/styles.xml')
+
+def normalize_sheet_name(name):
+    return re.sub(r"[ _－/.-]", "", str(name))
+
+def read_sheet_parts(source):
+    """
+    由 xlsx 壓縮檔目錄取得各分頁 XML 的大小與 CRC，不解析任何儲存格。
+    分頁 XML 內的文字儲存格只存 sharedStrings 的索引 (格式則指向 styles)，
+    因此指紋併入這兩個共用檔的 CRC，文字內容變動時所有分頁的指紋都會跟著變。
+    """
+    parts = {}
+    with zipfile.ZipFile(source) as zf:
+        names = set(zf.namelist())
+        shared = "".join(f"{zf.getinfo(p).CRC:08x}" for p in XLSX_SHARED_PARTS if p in names)
+        book = ET.fromstring(zf.read('xl/workbook.xml'))
+        rels = {r.get('Id'): r.get('Target') for r in ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))}
+        for sheet in book.find('m:sheets', XLSX_NS):
+            target = rels.get(sheet.get(XLSX_RID), '')
+            path = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+            try: info = zf.getinfo(path)
+            except KeyError: continue
+            parts[sheet.get('name')] = {'Bytes': info.file_size, 'Fingerprint': f"{info.CRC:08x}{shared}"}
+    return parts
+
+class SheetCatalog:
+    """活頁簿分頁索引：正規化後的 (年, 月) → 日報表分頁名稱，並附每個分頁的大小與內容指紋"""
+
+    def __init__(self, sheet_names, parts=None):
+        self.parts = parts or {}
+        self.daily = {}
+        self.year_only = set()
+        for name in sheet_names:
+            # 整個名稱須完全符合，"日報表202501 的副本" 之類的複本不列入
+            match = DAILY_SHEET_PATTERN.fullmatch(normalize_sheet_name(name))
+            if not match: continue
+            year, month = int(match.group(1)), match.group(2)
+            if month is None: self.year_only.add(year); continue
+            if not 1 <= int(month) <= 12: continue
+            key = (year, int(month))
+            # 同月份同時有 "202501" 與 "20251" 兩種寫法時，以補零的名稱為準
+            if key not in self.daily or len(month) == 2: self.daily[key] = name
+
+    def years(self):
+        return sorted({y for y, _ in self.daily} | self.year_only, reverse=True)
+
+    def sheet(self, year, month):
+        return self.daily.get((year, month))
+
+    def months(self, date_range=None):
+        """日報表涵蓋的 (年, 月)，由新到舊；可用全域日期區間過濾"""
+        keys = sorted(self.daily, reverse=True)
+        if date_range is None: return keys
+        lo, hi = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+        return [(y, m) for y, m in keys if (lo.year, lo.month) <= (y, m) <= (hi.year, hi.month)]
+
+    def info(self, sheet_name):
+        """分頁的 XML 大小 (Bytes) 與 CRC 指紋 (Fingerprint)；無原始檔時為空字典"""
+        return self.parts.get(sheet_name, {})
+
+@st.cache_resource(ttl=60, max_entries=2, hash_funcs=WORKBOOK_HASH, show_spinner=False)
+def get_sheet_catalog(xls):
+    """每份活頁簿快照只建立一次的分頁索引，所有 session 與分頁共用"""
+    parts = {}
+    source = getattr(xls, 'source', None)
+    if source is not None:
+        try: parts = read_sheet_parts(source)
+        except (zipfile.BadZipFile, KeyError, ET.ParseError): parts = {}
+    return SheetCatalog(xls.sheet_names, parts)
+
+def sheet_cache_key(xls, sheet_name):
+    """單一分頁的快取鍵：分頁指紋 + 大小；無分頁指紋 (非 xlsx 原始檔) 時退回整份活頁簿的內容雜湊"""
+    info = get_sheet_catalog(xls).info(sheet_name)
+    return f"{info['Fingerprint']}-{info['Bytes']}" if info else workbook_fingerprint(xls)
+
 # --- 讀取單一分頁邏輯 ---
 def read_daily_pnl(xls, sheet_name):
     try:
@@ -61,6 +167,220 @@ def read_daily_pnl(xls, sheet_name):
         return pd.DataFrame()
     except: return pd.DataFrame()
 
+@st.cache_resource(max_entries=128, show_spinner=False)
+def _load_daily_pnl(sheet_key, sheet_name, _xls):
+    return read_daily_pnl(_xls, sheet_name)
+
+def load_daily_pnl(xls, sheet_name):
+    """read_daily_pnl 的共用快取版：內容未變的月份分頁跨快照沿用 (回傳值視為唯讀)"""
+    return _load_daily_pnl(sheet_cache_key(xls, sheet_name), sheet_name, xls)
+
+# --- 共用唯讀交易表 (期望值分頁，全程序只建一份) ---
+TRADE_COLUMNS = {
+    '日期': 'Date',
+    '策略': 'Strategy',
+    '標的': 'Symbol',
+    '1R單位': 'Risk_Amount',
+    '損益': 'PnL',
+    '標準R(盈虧比)': 'R'
+}
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def build_trade_table(df):
+    """將期望值分頁原始資料轉成緊湊欄位型別 (類別 + float32) 並依日期穩定排序"""
+    for excel_col, target_col in TRADE_COLUMNS.items():
+        if excel_col not in df.columns:
+            if target_col == 'Strategy': df[excel_col] = '未分類'
+            elif target_col == 'Symbol': df[excel_col] = '未知標的'
+            else: df[excel_col] = np.nan
+    df = df[list(TRADE_COLUMNS)].rename(columns=TRADE_COLUMNS)
+
+    # 日期欄為合併儲存格時只有第一列有值，向下補齊
+    dates = pd.to_datetime(df['Date'].ffill(), errors='coerce').dt.normalize()
+    pnl = clean_numeric_column(df['PnL'])
+    keep = (dates.notna() & pnl.notna()).to_numpy()
+
+    table = pd.DataFrame({
+        'Date': dates[keep].to_numpy(),
+        'Strategy': pd.Categorical(df['Strategy'][keep].fillna('未分類').astype(str)),
+        'Symbol': pd.Categorical(df['Symbol'][keep].fillna('未知標的').astype(str)),
+        'Risk_Amount': clean_numeric_column(df['Risk_Amount'])[keep].to_numpy(dtype='float32'),
+        'PnL': pnl[keep].to_numpy(dtype='float32'),
+        'R': clean_numeric_column(df['R'])[keep].to_numpy(dtype='float32'),
+    })
+    table = table.sort_values('Date', kind='stable', ignore_index=True)
+    table['Weekday'] = pd.Categorical.from_codes(table['Date'].dt.dayofweek.to_numpy(), categories=WEEKDAYS)
+    return table
+
+@st.cache_resource(ttl=60, max_entries=2, hash_funcs=WORKBOOK_HASH, show_spinner=False)
+def get_trade_table(xls):
+    """全程序共用的唯讀交易表；各 session 只取切片檢視，不各自複製"""
+    target_sheet = next((name for name in xls.sheet_names if "期望值" in name), None)
+    if not target_sheet: return None, "找不到 '期望值' 分頁"
+    try:
+        # header=14 代表從第 15 列開始抓取
+        return build_trade_table(pd.read_excel(xls, sheet_name=target_sheet, header=14)), None
+    except Exception as e:
+        return None, f"讀取失敗: {e}"
+
+def table_view(table, mask):
+    """
+    條件全成立時回傳原表的 iloc 檢視 (共用資料但為獨立物件，不複製)；否則布林篩選會複製出一份子表。
+    絕不回傳共用表本身，否則 session 端的 df['x'] = ... 會直接改到所有 session 看到的表。
+    """
+    return table.iloc[:] if mask.all() else table[mask]
+
+def legacy_frame_bytes(table):
+    """
+    估算改版前 (object 字串 + float64) 同一張表的記憶體，不實際轉型複製：
+    數值與日期欄每列 8 bytes，字串欄每列一個指標再加上各字串物件大小 (依類別出現次數加權)。
+    """
+    n = len(table)
+    total = int(table.index.memory_usage(deep=True))
+    for col in table.columns:
+        series = table[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            counts = np.bincount(series.cat.codes.to_numpy()[series.cat.codes.to_numpy() >= 0], minlength=len(series.cat.categories))
+            total += 8 * n + int(counts @ np.array([sys.getsizeof(c) for c in series.cat.categories], dtype='int64'))
+        else:
+            total += 8 * n
+    return total
+
+def resident_bytes(frame, table):
+    """frame 在 table 之外實際多佔的記憶體：共用列資料 (iloc 檢視) 時只計索引，布林篩選產生的複本計整份"""
+    if np.may_share_memory(frame['PnL'].to_numpy(), table['PnL'].to_numpy()): return int(frame.index.memory_usage(deep=True))
+    return int(frame.memory_usage(deep=True).sum())
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def measure_session_memory(snapshot, _table, _filtered, n_sessions):
+    """
+    比較 N 個同時在線 session 的記憶體：共用唯讀表 vs. 每個 session 各自複製 (bytes)。
+    共用表與各分頁快取的篩選結果 (_filtered) 以 memory_usage 實際量測；
+    舊版總量與每個 session 的檢視外殼為估算。以 (snapshot, n_sessions) 為快取鍵，同一份資料只算一次。
+    """
+    shared = int(_table.memory_usage(deep=True).sum())
+    filtered = sum(resident_bytes(f, _table) for f in _filtered if f is not None)
+    # 舊版每個 session 讀兩次 (期望值實驗室 + 進階分析)，各一份完整 float64/object 複本 (估算)
+    legacy_per_session = 2 * legacy_frame_bytes(_table)
+    # 每個 session 對篩選結果做的日期切片是 iloc 檢視，只有自己的索引與欄位外殼 (估算)
+    view_bytes = n_sessions * int(_table.iloc[0:0].memory_usage(deep=True).sum())
+
+    return {
+        "Sessions": n_sessions,
+        "Shared Table": shared,
+        "Filtered Copies": filtered,
+        "View Overhead": view_bytes,
+        "Shared Total": shared + filtered + view_bytes,
+        "Legacy Total": legacy_per_session * n_sessions,
+    }
+
+# --- 全域日期區間 (已排序時間索引切片) ---
+def date_positions(dates, start=None, end=None):
+    """在已排序的 datetime64 陣列上以 searchsorted 找出 [start, end] 的位置區間"""
+    values = dates.values if hasattr(dates, 'values') else np.asarray(dates)
+    lo = 0 if start is None else values.searchsorted(pd.Timestamp(start).to_datetime64(), side='left')
+    hi = len(values) if end is None else values.searchsorted((pd.Timestamp(end) + pd.Timedelta(days=1)).to_datetime64(), side='left')
+    return int(lo), int(max(lo, hi))
+
+def slice_by_date(df, date_range, col='Date'):
+    """依全域日期區間切出連續列 (iloc 切片，不複製資料)；一律回傳新的檢視物件，不回傳傳入的共用表本身"""
+    if df is None: return df
+    if df.empty or date_range is None: return df.iloc[:]
+    if not df[col].is_monotonic_increasing: df = df.sort_values(col)
+    lo, hi = date_positions(df[col], *date_range)
+    return df.iloc[lo:hi]
+
+def clip_range(date_range, start, end):
+    """將全域區間與 [start, end] 取交集，無交集回傳 None"""
+    if date_range is None: return (pd.Timestamp(start), pd.Timestamp(end))
+    lo, hi = max(pd.Timestamp(date_range[0]), pd.Timestamp(start)), min(pd.Timestamp(date_range[1]), pd.Timestamp(end))
+    return (lo, hi) if lo <= hi else None
+
+def earliest_data_date(xls):
+    """期望值交易與日報表分頁中最早的日期，作為全域區間的預設起日；皆無資料時回傳 None"""
+    candidates = []
+    table, _ = get_trade_table(xls)
+    if table is not None and not table.empty: candidates.append(table['Date'].iloc[0].date())
+    catalog = get_sheet_catalog(xls)
+    if catalog.daily: candidates.append(date(*min(catalog.daily), 1))
+    if catalog.year_only: candidates.append(date(min(catalog.year_only), 1, 1))
+    return min(candidates) if candidates else None
+
+def date_range_selector(first_date):
+    """側邊欄全域日期區間選擇器，回傳 (start, end) Timestamp"""
+    today = date.today()
+    default = (min(first_date, today), today)
+    picked = st.sidebar.date_input("📆 分析區間", value=default, max_value=today, key='global_date_range')
+    # 使用者只選了起日時，先沿用預設迄日
+    if not isinstance(picked, (tuple, list)): picked = (picked, today)
+    elif len(picked) < 2: picked = (picked[0] if picked else default[0], today)
+    return pd.Timestamp(picked[0]), pd.Timestamp(picked[1])
+
+# --- 圖表快取 (快照 × 函式 × 檢視參數 → Figure) ---
+def snapshot_key(xls, date_range=None):
+    """資料快照鍵：活頁簿內容雜湊 + 全域日期區間"""
+    if date_range is None: return workbook_fingerprint(xls)
+    return f"{workbook_fingerprint(xls)}|{date_range[0]:%Y%m%d}-{date_range[1]:%Y%m%d}"
+
+class FigureCache:
+    """
+    以 LRU 與位元組上限管理的圖表快取，跨 session 共用。
+    直接保存建好的 go.Figure (呼叫端視為唯讀、不再 update)：st.plotly_chart 收到 Figure 只做 to_dict，
+    收到 dict 則會重建並驗證整張圖，反而比重畫還慢。
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _dump(result):
+        # 回傳 (保存值, 估計位元組)；Figure 以 JSON 長度計入上限，tuple (如年度 KPI + 圖) 逐項加總
+        if isinstance(result, go.Figure):
+            return result, len(result.to_json())
+        if isinstance(result, tuple):
+            return result, sum(FigureCache._dump(r)[1] for r in result)
+        return result, sys.getsizeof(result)
+
+    def get_or_build(self, key, build):
+        with self.lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return payload[0]
+            self.misses += 1
+
+        result = build()
+        payload = self._dump(result)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = payload
+                self.nbytes += payload[1]
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, size) = self.entries.popitem(last=False)
+                self.nbytes -= size
+                self.evictions += 1
+        return payload[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"Entries": len(self.entries), "Bytes": self.nbytes, "Hits": self.hits, "Misses": self.misses,
+                "Evictions": self.evictions, "Hit Rate": self.hits / total if total else 0.0}
+
+@st.cache_resource
+def get_figure_cache():
+    """全程序共用的圖表快取"""
+    return FigureCache()
+
+def cached_figure(snapshot, params, func, *args):
+    """以 (快照, 函式, 檢視參數) 取用圖表；params 需涵蓋 args 中資料切片的所有篩選條件"""
+    key = (snapshot, f"{func.__module__}.{func.__qualname__}", repr(params))
+    return get_figure_cache().get_or_build(key, lambda: func(*args))
+
 # --- 數學插值 (紅綠分色用) ---
 def insert_zero_crossings(df):
     if df.empty: return df